@@ -1,6 +1,7 @@
 import json
 import os
 import unittest
+from array import array
 
 import pytest
 from zensearch.entity_engine import Entity
@@ -117,7 +118,7 @@ class TestEntityEngineLoadData:
             "[]": {"_id": {}},
             '{"_id": 1}': {"_id": {"1": {"_id": 1}}},
             '[{"_id": 1}]': {"_id": {"1": {"_id": 1}}},
-            '[{"_id": 1, "d": 2}]': {"_id": {"1": {"_id": 1, "d": 2}}, "d": {2: [1]}},
+            '[{"_id": 1, "d": 2}]': {"_id": {"1": {"_id": 1, "d": 2}}, "d": {2: array("i", [0])}},
         }
         for in_data in test_io:
             tmp_file_name = f"{tmpdir}/invalid_json.json"
@@ -140,7 +141,7 @@ class TestEntityEngineLoadData:
             {"_id": {}},
             {"_id": {"1": {"_id": 1}}},
             {"_id": {"1": {"_id": 1}}},
-            {"_id": {"1": {"_id": 1, "d": 2}}, "d": {2: [1]}},
+            {"_id": {"1": {"_id": 1, "d": 2}}, "d": {2: array("i", [0])}},
         ]
         for inp, out in zip(test_in_data, test_out_data):
 
@@ -169,6 +170,26 @@ class TestEntityEngineLoadData:
         assert test_primary_key == entity.primary_key
         assert expected_index == entity._indices
 
+    def test_entity_multiple_loads(self):
+        """Loading more data into the same entity should keep the rows from
+        earlier loads searchable (and their posting list row ids valid)
+        """
+        entity = Entity("user")
+        entity.load_data_build_indices(
+            [
+                {"_id": 1, "name": "a"},
+                {"_id": 2, "name": "a"},
+                {"_id": 3, "name": "a"},
+            ]
+        )
+        entity.load_data_build_indices([{"_id": 4, "name": "a"}])
+
+        assert [1, 2, 3, 4] == [match["_id"] for match in entity.search("name", "a")]
+        assert [{"_id": 2, "name": "a"}] == list(entity.search("_id", 2))
+
+        with pytest.raises(DuplicatePrimaryKeyError):
+            entity.load_data_build_indices([{"_id": 1, "name": "b"}])
+
     def test_build_load_invalid_data_type(self):
         """Valid data = [], [{"primary_key": }], 'path/to/file'
         Invalid data should throw a value error
@@ -217,13 +238,13 @@ class TestEntityEngineBuildIndices:
         ]
         test_ticket_out_data = [
             {"_id": {}},
-            {"_id": {"1": {"_id": 1, "name": "surya"}}, "name": {"surya": [1]}},
+            {"_id": {"1": {"_id": 1, "name": "surya"}}, "name": {"surya": array("i", [0])}},
             {
                 "_id": {
                     "1": {"_id": 1, "name": "surya"},
                     "2": {"_id": 2, "name": "surya"},
                 },
-                "name": {"surya": [1, 2]},
+                "name": {"surya": array("i", [0, 1])},
             },
             {
                 "_id": {
@@ -234,14 +255,12 @@ class TestEntityEngineBuildIndices:
                     },
                 },
                 "url": {
-                    "http://initech.zendesk.com/api/v2/tickets/436bf9b0-1147-4c0a-8439-6f79833bff5b.json": [
-                        "436bf9b0-1147-4c0a-8439-6f79833bff5b"
-                    ]
+                    "http://initech.zendesk.com/api/v2/tickets/436bf9b0-1147-4c0a-8439-6f79833bff5b.json": array(
+                        "i", [0]
+                    )
                 },
                 "external_id": {
-                    "9210cdc9-4bee-485f-a078-35396cd74063": [
-                        "436bf9b0-1147-4c0a-8439-6f79833bff5b"
-                    ]
+                    "9210cdc9-4bee-485f-a078-35396cd74063": array("i", [0])
                 },
             },
         ]
@@ -267,8 +286,8 @@ class TestEntityEngineBuildIndices:
         test_out_data = [
             {"_id": {"": {"_id": ""}}},
             {"_id": {" ": {"_id": " "}}},
-            {"_id": {"1": {"_id": 1, "tags": []}}, "tags": {"": [1]}},
-            {"_id": {"": {"_id": "", "name": "surya"}}, "name": {"surya": [""]}},
+            {"_id": {"1": {"_id": 1, "tags": []}}, "tags": {"": array("i", [0])}},
+            {"_id": {"": {"_id": "", "name": "surya"}}, "name": {"surya": array("i", [0])}},
         ]
 
         for inp, out in zip(test_in_data, test_out_data):
@@ -287,9 +306,9 @@ class TestEntityEngineBuildIndices:
         test_out_data = [
             {
                 "_id": {"1": {"_id": 1, "tags": ["tag1", "tag2"]}},
-                "tags": {"tag1": [1], "tag2": [1]},
+                "tags": {"tag1": array("i", [0]), "tag2": array("i", [0])},
             },
-            {"_id": {"1": {"_id": 1, "tags": []}}, "tags": {"": [1]}},
+            {"_id": {"1": {"_id": 1, "tags": []}}, "tags": {"": array("i", [0])}},
         ]
 
         for inp, out in zip(test_in_data, test_out_data):
@@ -299,6 +318,29 @@ class TestEntityEngineBuildIndices:
 
         assert True
 
+    def test_build_index_mixed_scalar_tuple(self):
+        """A tuple in a field whose other rows are scalars should still be
+        flattened, not indexed as the tuple itself
+        """
+        test_in_data = [
+            {"_id": 1, "f": "a"},
+            {"_id": 2, "f": ("x", "y")},
+        ]
+        test_out_data = {
+            "_id": {"1": test_in_data[0], "2": test_in_data[1]},
+            "f": {
+                "a": array("i", [0]),
+                "x": array("i", [1]),
+                "y": array("i", [1]),
+            },
+        }
+
+        entity = Entity("ticket")
+        entity.load_data_build_indices(test_in_data)
+
+        assert test_out_data == entity._indices
+        assert [2] == [match["_id"] for match in entity.search("f", "x")]
+
     def test_build_index_unhashable(self):
         """Unhashable values in data point's fields should throw TypeErrors
         """
@@ -349,6 +391,87 @@ class TestEntityEngineBuildIndices:
                 assert "Duplicate primary key value: " in str(error.value)
         assert True
 
+    def test_duplicate_primary_key_same_object(self):
+        """The same data point object appearing twice is still a duplicate
+        """
+        data_point = {"_id": 9}
+        entity = Entity("user")
+        with pytest.raises(DuplicatePrimaryKeyError) as error:
+            entity.load_data_build_indices([data_point, data_point])
+            assert "Duplicate primary key value: " in str(error.value)
+        assert True
+
+    def test_duplicate_primary_key_load_after_failed_load(self):
+        """A load that raised on a duplicate should not make the entity
+        reject later loads of perfectly valid data
+        """
+        entity = Entity("user")
+        entity.load_data_build_indices([{"_id": 1}])
+        with pytest.raises(DuplicatePrimaryKeyError):
+            entity.load_data_build_indices([{"_id": 1}])
+
+        entity.load_data_build_indices([{"_id": 2}])
+
+        assert [{"_id": 2}] == list(entity.search("_id", 2))
+
+
+class TestEntityEngineLazyIndices:
+    def test_lazy_entity_builds_only_primary_index(self):
+        """lazy_indices=True should only build the primary key index at load time
+        """
+        users = [{"_id": 1, "name": "one", "tags": ["tag1"]}]
+        entity = Entity("user", lazy_indices=True)
+        entity.load_data_build_indices(users)
+
+        assert list(entity._indices.keys()) == ["_id"]
+        assert entity._indices["_id"] == {"1": users[0]}
+
+    def test_lazy_entity_search_builds_field_index_on_demand(self):
+        """The first search on a field should build (and keep) that field's index
+        and return the same matches as an eager entity
+        """
+        users = [
+            {"_id": 1, "name": "one"},
+            {"_id": 2, "name": "two"},
+        ]
+        entity = Entity("user", lazy_indices=True)
+        entity.load_data_build_indices(users)
+
+        assert [users[1]] == list(entity.search("name", "two"))
+        assert entity._indices["name"] == {
+            "one": array("i", [0]),
+            "two": array("i", [1]),
+        }
+        assert [users[0]] == list(entity.search("_id", 1))
+        assert [] == list(entity.search("foo_index", "zero"))
+
+    def test_lazy_entity_searchable_fields(self):
+        """Searchable fields should cover every field in the data even before
+        any secondary index has been built
+        """
+        users = [
+            {"_id": 1, "name": "one"},
+            {"_id": 2, "alias": "two"},
+        ]
+        entity = Entity("user", lazy_indices=True)
+        entity.load_data_build_indices(users)
+
+        assert set(entity.get_searchable_fields()) == set(["_id", "name", "alias"])
+
+    def test_lazy_entity_multiple_loads(self):
+        """A secondary index materialized by a search should pick up the rows
+        of later loads, just like the eager entity's indices do
+        """
+        entity = Entity("user", lazy_indices=True)
+        entity.load_data_build_indices([{"_id": 1, "name": "a"}])
+
+        assert [1] == [match["_id"] for match in entity.search("name", "a")]
+
+        entity.load_data_build_indices([{"_id": 2, "name": "a"}])
+
+        assert [1, 2] == [match["_id"] for match in entity.search("name", "a")]
+        assert [{"_id": 2, "name": "a"}] == list(entity.search("_id", 2))
+
 
 class TestEntityEngineDataFromPrimaryKeys:
     def test_entity_match_list_primary_keys(self):
@@ -424,6 +547,36 @@ class TestEntityEngineDataFromPrimaryKeys:
         assert [] == list(entity.get_data_from_primary_keys(""))
         assert [] == list(entity.get_data_from_primary_keys(None))
 
+    def test_entity_match_non_json_values_integrity(self):
+        """Cloned matches should keep non JSON types (sets, dicts) as they are
+        and not share them with the ground data
+        """
+        users = [{"_id": {1}}]
+        entity = get_entity_from_formatted_data("user", users)
+
+        match = list(entity.get_data_from_primary_keys(["{1}"]))[0]
+        assert match == {"_id": {1}}
+
+        match["_id"].add(2)
+        assert entity._data[0]["_id"] == {1}
+
+    def test_entity_read_only_matches(self):
+        """copy=False should hand out read only views of the indexed data without cloning
+        """
+        users = [
+            {"_id": 1, "name": "one"},
+            {"_id": 2, "name": "two"},
+            {"_id": 3, "name": "three"},
+        ]
+        entity = get_entity_from_formatted_data("user", users)
+
+        matches = list(entity.get_data_from_primary_keys([1, 2], copy=False))
+        assert users[:-1] == matches
+
+        with pytest.raises(TypeError):
+            matches[0]["_id"] = 55
+        assert entity._indices["_id"]["1"]["_id"] == 1
+
     def test_entity_ground_data_integrity(self):
         users = [
             {"_id": 1, "name": "one"},
@@ -64,10 +64,8 @@ class TestMiscFunctions:
         for entity in test_data_from_files:
             for data_point in test_data_from_files[entity]:
                 data_key_sets[entity].update(data_point.keys())
-            from_files = list(data_key_sets[entity])
-            from_app = zen._get_entity_searchable_fields(entity)
-            from_files.sort()
-            from_app.sort()
+            from_files = sorted(data_key_sets[entity])
+            from_app = sorted(zen._get_entity_searchable_fields(entity))
             assert from_app == from_files
         return
 
@@ -77,10 +75,8 @@ class TestMiscFunctions:
         for entity in test_data_from_files:
             for data_point in test_data_from_files[entity]:
                 data_key_sets[entity].update(data_point.keys())
-            from_files = list(data_key_sets[entity])
-            from_app = searchable_fields_dict[entity]
-            from_files.sort()
-            from_app.sort()
+            from_files = sorted(data_key_sets[entity])
+            from_app = sorted(searchable_fields_dict[entity])
             assert from_app == from_files
         return
 
@@ -1,96 +1,372 @@
-from collections.abc import Hashable
+from array import array
+from functools import lru_cache
 
-# from copy import deepcopy
-import ujson
+# pickle only ever round trips values this process produced itself (see
+# _clone_data_point); no untrusted bytes are deserialized
+from pickle import HIGHEST_PROTOCOL  # nosec B403
+from pickle import dumps as pickle_dumps  # nosec B403
+from pickle import loads as pickle_loads  # nosec B403
+from sys import intern
+from types import MappingProxyType
+
+try:
+    # orjson parses dict heavy payloads a few times faster than ujson
+    import orjson as _json
+except ImportError:
+    import ujson as _json
+
+try:
+    # ijson lets us stream records out of very large files one at a time
+    import ijson
+except ImportError:
+    ijson = None
+
+from os.path import getsize
 from zensearch.exceptions import DuplicatePrimaryKeyError, PrimaryKeyNotFoundError
 
-# import json
+# files bigger than this are stream-parsed (when ijson is available) so the
+# whole file text never sits in memory next to the parsed data points
+STREAM_PARSE_MIN_BYTES = 64 * 1024 * 1024
+
+# bound on the per-entity memo of resolved searches; query distributions are
+# typically skewed, so a small cache absorbs most repeats
+SEARCH_CACHE_MAXSIZE = 1024
+
+
+def _as_index_key(key):
+    """Return the primary key index form of a lookup key
+
+    Index keys are (interned) strings; keys that already are strings skip the
+    str() allocation and get the pointer-compare fast path in the dict lookup
+
+    Args:
+        key: primary key value to look up
+
+    Returns:
+        str: key usable against the primary key index
+    """
+    return key if type(key) is str else str(key)
+
+
+_SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
+def _clone_data_point(data_point):
+    """Clone a data point so that callers can't mutate the indexed ground data
+
+    Data points in this schema are flat dicts with scalar or list-of-scalar
+    values, so scalars pass through and lists are sliced. Anything else
+    (sets, nested dicts, arbitrary objects) is round tripped through pickle,
+    which preserves the exact type where a JSON round trip would silently
+    rewrite it (sets to lists etc.)
+
+    Args:
+        data_point (dict): data point to clone
+
+    Returns:
+        dict: clone of data_point safe to mutate
+    """
+    return {
+        key: (
+            value
+            if type(value) in _SCALAR_TYPES
+            else (
+                value[:]
+                if type(value) is list
+                # the bytes come straight from pickle_dumps on the same
+                # line, never from outside the process
+                else pickle_loads(pickle_dumps(value, HIGHEST_PROTOCOL))  # nosec B301
+            )
+        )
+        for key, value in data_point.items()
+    }
 
 
 class Entity:
     """Entity class to represent entities such as users, tickets and organizations
     """
 
-    def __init__(self, entity_name, primary_key="_id"):
-        # indices["_id"] = {1: user1, 2: user2}
+    # no per-instance __dict__: saves ~100 bytes per entity and turns every
+    # self.<attr> load in the hot paths into a fixed slot lookup
+    __slots__ = (
+        "entity_name",
+        "primary_key",
+        "_indices",
+        "_data",
+        "_keys_set",
+        "_cached_matches",
+        "_lazy_indices",
+    )
+
+    def __init__(self, entity_name, primary_key="_id", lazy_indices=False):
+        # indices["_id"] = {"1": user1, "2": user2}
+        # non primary indices hold row ids into _data: indices["name"] = {"surya": [0, 1]}
         self.entity_name = entity_name
         self.primary_key = primary_key
+        # lazy_indices=True builds only the primary key index at load time and
+        # each secondary index on the first search of its field
+        self._lazy_indices = lazy_indices
         self._indices = {self.primary_key: {}}
         self._data = []
         self._keys_set = set()
+        # per instance memo of resolved (search_key, search_term) matches;
+        # typed=True keeps 1, 1.0 and True apart like str() keys do
+        self._cached_matches = lru_cache(maxsize=SEARCH_CACHE_MAXSIZE, typed=True)(
+            self._resolve_matches
+        )
 
-    def _build_indices(self):
-        if self._data == []:
-            # return if data is []
+    def _build_indices(self, start_row_id=0):
+        # start_row_id is where the rows of the current load begin in _data:
+        # earlier rows were indexed by previous loads and their row ids (and
+        # index entries) stay valid
+        if len(self._data) == start_row_id:
+            # return if there is no new data
             return
         # if not isinstance(self._data, list):
         #     raise ValueError(
         #         f"Invalid entity data give found while trying to build indices. Data given to build indices should be a list() of dict()"
         #     )
-        for data_point in self._data:
-            self._check_for_mandatory_keys(data_point)
-            primary_key = data_point[self.primary_key]
-
-            for field in self._keys_set:
-                field_value = data_point.get(field, "")
-                # if field is primary_key, then we link the data point itself directly to the (primary_key) index key (=data point primary key value)
-                if field == self.primary_key:
-                    # throw an error if/when a primary key has already been seen
-                    if self._indices[field].get(str(field_value), None):
-                        raise DuplicatePrimaryKeyError(
-                            f"Duplicate primary key value: {field_value} found in the data point. It's been assumed that every entity should have a unique set of primary keys"
-                        )
-                    self._indices[field][str(field_value)] = data_point
-                # if the data point's field value is unhashable, then raise an TypeError
-                elif not isinstance(field_value, Hashable) and not isinstance(
-                    field_value, list
-                ):
-                    raise TypeError(
-                        f"Unhashable value {field_value} found in field: {field} for data point: {data_point}"
-                    )
-                # if field is a list in itself, then we flatten it and use each of those item items as a value
-                elif isinstance(field_value, list) or isinstance(field_value, tuple):
-                    if len(field_value) == 0:
-                        self.__update_non_primary_index(primary_key, field, "")
-                    else:
-                        for idx, sub_field in enumerate(field_value):
-                            self.__update_non_primary_index(
-                                primary_key, field, sub_field
-                            )
-                else:
-                    self.__update_non_primary_index(primary_key, field, field_value)
+        # bind the per-row invariants to locals once: attribute loads and
+        # bound-method lookups inside this loop cost O(rows * fields) otherwise
+        primary_key_name = self.primary_key
+        pk_index = self._indices[primary_key_name]
+        if self._lazy_indices:
+            # secondary indices are built on demand in _resolve_matches, but
+            # any a search already materialized must absorb the new rows too
+            # or they'd silently keep serving pre-load results
+            field_indices = {
+                field: field_index
+                for field, field_index in self._indices.items()
+                if field != primary_key_name
+            }
+        else:
+            field_indices = {
+                field: self._indices.setdefault(field, {})
+                for field in self._keys_set
+                if field != primary_key_name
+            }
+        # classify every field once from the first new row, so the hot loop
+        # runs the matching branch directly instead of type-dispatching per
+        # value; rows that disagree with their bucket take the generic path
+        first_data_point = self._data[start_row_id]
+        scalar_fields = []
+        list_fields = []
+        for field, field_index in field_indices.items():
+            if type(first_data_point.get(field, "")) in (list, tuple):
+                list_fields.append((field, field_index))
+            else:
+                scalar_fields.append((field, field_index))
+
+        # rows were already validated in load_data_build_indices; ingest each
+        # new one through a function generated for exactly this schema
+        ingest_row = self._compile_row_ingest(pk_index, scalar_fields, list_fields)
+        data = self._data
+        for row_id in range(start_row_id, len(data)):
+            ingest_row(row_id, data[row_id])
+
+        # posting lists are built as python lists for the O(1) append, then
+        # compacted into packed int arrays (4 bytes per row id instead of a
+        # pointer to a boxed int) once the build is done
+        for field_index in field_indices.values():
+            for data_value, row_ids in field_index.items():
+                field_index[data_value] = array("i", row_ids)
         return
 
-    def __update_non_primary_index(self, primary_key_value, index_name, data_value):
-        # if the index_name exist then look for the data_value in the index
-        if self._indices.get(index_name, None):
-            # if the data_value in the index exist as well, then append the data_point to the list
-            if self._indices[index_name].get(data_value, None):
-                self._indices[index_name][data_value].append(primary_key_value)
-            # if the value in the index DOES NOT exist, then create a new list with value as it's first and only data_point
+    def _build_field_index(self, field):
+        """Build, register and return the secondary index for one field
+
+        This is the just-in-time half of lazy_indices=True: the field's index
+        is built from _data with the same flattening, interning and posting
+        list compaction as the eager build, then cached in _indices so later
+        searches find it directly
+
+        Args:
+            field (str): non primary field to index
+
+        Returns:
+            dict: the field's index of value -> packed row id array
+        """
+        field_index = {}
+        index_field_value = self.__index_field_value
+        for row_id, data_point in enumerate(self._data):
+            index_field_value(
+                row_id, field, field_index, data_point.get(field, ""), data_point
+            )
+        for data_value, row_ids in field_index.items():
+            field_index[data_value] = array("i", row_ids)
+        self._indices[field] = field_index
+        return field_index
+
+    def _compile_row_ingest(self, pk_index, scalar_fields, list_fields):
+        """Generate a row ingest function specialized to this entity's schema
+
+        The generated function is straight line code over the exact fields of
+        the loaded data: no per-value type dispatch and no dict-of-indices
+        probing, with every index dict bound as a default argument so each
+        access is a plain local load. Values that don't match their field's
+        bucket fall back to the generic __index_field_value handler
+
+        Args:
+            pk_index (dict): inner dict of the primary key index
+            scalar_fields (list): (field, field_index) pairs classified scalar
+            list_fields (list): (field, field_index) pairs classified list
+
+        Returns:
+            function: ingest(row_id, data_point) indexing one data point
+        """
+        bound = {
+            "_intern": intern,
+            "_pk_index": pk_index,
+            "_index_field_value": self.__index_field_value,
+        }
+        lines = [
+            f"    primary_key = data_point[{self.primary_key!r}]",
+            "    string_primary_key = _intern(str(primary_key))",
+            "    # setdefault probes and assigns in one hash; a key taken by",
+            "    # another data point hands back a different object, and a",
+            "    # repeat of the same object leaves the index size unchanged,",
+            "    # so the before/after length catches what the identity check",
+            "    # cannot (and depends on nothing outside this row)",
+            "    pk_count = len(_pk_index)",
+            "    if (",
+            "        _pk_index.setdefault(string_primary_key, data_point)",
+            "        is not data_point",
+            "        or len(_pk_index) == pk_count",
+            "    ):",
+            "        raise DuplicatePrimaryKeyError(",
+            '            f"Duplicate primary key value: {primary_key} found in the data point. It\'s been assumed that every entity should have a unique set of primary keys"',
+            "        )",
+        ]
+        for number, (field, field_index) in enumerate(scalar_fields):
+            index_name = f"_index_{number}"
+            bound[index_name] = field_index
+            lines += [
+                f'    value = data_point.get({field!r}, "")',
+                "    if type(value) is str:",
+                "        value = _intern(value)",
+                f"        {index_name}.setdefault(value, []).append(row_id)",
+                "    elif type(value) is list or type(value) is tuple:",
+                "        # rows that disagree with the scalar classification;",
+                "        # tuples are hashable, so the TypeError below would",
+                "        # never fire and the tuple would be indexed whole",
+                f"        _index_field_value(row_id, {field!r}, {index_name}, value, data_point)",
+                "    else:",
+                "        try:",
+                f"            {index_name}.setdefault(value, []).append(row_id)",
+                "        except TypeError:",
+                f"            _index_field_value(row_id, {field!r}, {index_name}, value, data_point)",
+            ]
+        for number, (field, field_index) in enumerate(list_fields):
+            index_name = f"_list_index_{number}"
+            bound[index_name] = field_index
+            lines += [
+                f'    value = data_point.get({field!r}, "")',
+                "    if type(value) is list or type(value) is tuple:",
+                "        if value:",
+                "            for sub_field in value:",
+                "                if type(sub_field) is str:",
+                "                    sub_field = _intern(sub_field)",
+                f"                {index_name}.setdefault(sub_field, []).append(row_id)",
+                "        else:",
+                f'            {index_name}.setdefault("", []).append(row_id)',
+                "    else:",
+                f"        _index_field_value(row_id, {field!r}, {index_name}, value, data_point)",
+            ]
+        lines.append("    return")
+
+        signature = ", ".join(f"{name}={name}" for name in bound)
+        source = f"def _ingest_row(row_id, data_point, {signature}):\n" + "\n".join(
+            lines
+        )
+        namespace = dict(bound)
+        namespace["DuplicatePrimaryKeyError"] = DuplicatePrimaryKeyError
+        # the source is assembled above from this entity's own schema (field
+        # names repr()-quoted), never from anything a caller controls
+        exec(source, namespace)  # nosec B102
+        return namespace["_ingest_row"]
+
+    def __index_field_value(self, row_id, field, field_index, field_value, data_point):
+        # generic (bucket agnostic) path for values that don't match their
+        # field's classification: flattens lists/tuples, raises on unhashables
+        value_type = type(field_value)
+        if value_type is list or value_type is tuple:
+            if len(field_value) == 0:
+                self.__update_non_primary_index(row_id, field_index, "")
             else:
-                self._indices[index_name][data_value] = [primary_key_value]
-        # if the index does not exist, create index and add the data_point as it's first and only data_point
+                for sub_field in field_value:
+                    self.__update_non_primary_index(row_id, field_index, sub_field)
         else:
-            self._indices[index_name] = {data_value: [primary_key_value]}
+            try:
+                self.__update_non_primary_index(row_id, field_index, field_value)
+            except TypeError:
+                raise TypeError(
+                    f"Unhashable value {field_value} found in field: {field} for data point: {data_point}"
+                )
+        return
 
+    def __update_non_primary_index(self, row_id, field_index, data_value):
+        # interning string values dedupes the copies repeated across rows and
+        # makes later lookups of the same string a pointer compare
+        if type(data_value) is str:
+            data_value = intern(data_value)
+        # one setdefault does the probe and (if needed) the list creation in a
+        # single hash of data_value; posting lists hold dense row ids into
+        # _data rather than (arbitrarily large) primary key values
+        field_index.setdefault(data_value, []).append(row_id)
         return
 
-    def search(self, search_key, search_term):
+    def search(self, search_key, search_term, copy=True):
+        try:
+            # repeated queries skip the index walk and only pay for the wrap
+            matches = self._cached_matches(search_key, search_term)
+        except TypeError:
+            # unhashable search term; only primary key searches take a list
+            if search_key == self.primary_key:
+                return self.get_data_from_primary_keys(search_term, copy=copy)
+            raise
+        wrap = _clone_data_point if copy else MappingProxyType
+        return (wrap(data_point) for data_point in matches)
+
+    def _resolve_matches(self, search_key, search_term):
+        # resolve one hashable (search_key, search_term) pair to the tuple of
+        # matched ground data points; callers wrap/clone them per call, so the
+        # memoized tuples can never be poisoned by caller mutation
         if search_key == self.primary_key:
-            return self.get_data_from_primary_keys(search_term)
-        elif self._indices.get(search_key, None) is None:
-            return []
-        else:
-            return self.get_data_from_primary_keys(
-                self._indices[search_key].get(search_term, None)
-            )
+            data_point = self._indices[search_key].get(_as_index_key(search_term), None)
+            return (data_point,) if data_point else ()
+        field_index = self._indices.get(search_key, None)
+        if field_index is None:
+            if self._lazy_indices and search_key in self._keys_set:
+                field_index = self._build_field_index(search_key)
+            else:
+                return ()
+        # index keys are interned, so an interned term hits the dict's
+        # pointer-equality fast path
+        if type(search_term) is str:
+            search_term = intern(search_term)
+        data = self._data
+        return tuple(
+            data[row_id] for row_id in field_index.get(search_term, None) or ()
+        )
 
     def load_data_build_indices(self, data_to_load):
 
         if isinstance(data_to_load, str):
-            with open(data_to_load, "r") as f:
-                data_red = ujson.load(f)
+            with open(data_to_load, "rb") as f:
+                if (
+                    ijson is not None
+                    and getsize(data_to_load) > STREAM_PARSE_MIN_BYTES
+                    and f.read(16).lstrip()[:1] == b"["
+                ):
+                    # stream the records of a big top level list one by one;
+                    # use_float keeps numbers as float like orjson/ujson do
+                    # instead of ijson's default decimal.Decimal
+                    f.seek(0)
+                    data_red = list(ijson.items(f, "item", use_float=True))
+                else:
+                    # orjson has no load(), so read then loads()
+                    f.seek(0)
+                    data_red = _json.loads(f.read())
             if isinstance(data_red, dict):
                 data_red = [data_red]
         # data is a data point
@@ -105,45 +381,57 @@ class Entity:
             raise TypeError(
                 "Data to load should be one of file path as str(), data point as dict() or data as list of data point()"
             )
-        self._data = data_red
-        self._keys_set = self._keys_set.union(*self._data)
-        self._build_indices()
-        return
-
-    def _check_for_mandatory_keys(self, data_point):
-        mandatory_keys = [self.primary_key]
-
-        for key in mandatory_keys:
-            if data_point.get(key, None) is None:
+        # validate every data point while collecting keys: failing fast here
+        # means _build_indices never has to check rows (or get left with a
+        # half-populated index by a bad row deep into the data)
+        primary_key_name = self.primary_key
+        entity_name = self.entity_name
+        # update the key set one data point at a time; union(*self._data)
+        # unpacks every data point into one giant argument tuple first
+        keys_set = self._keys_set
+        for data_point in data_red:
+            if (
+                not isinstance(data_point, dict)
+                or data_point.get(primary_key_name, None) is None
+            ):
                 raise PrimaryKeyNotFoundError(
-                    f"Cannot find {key} in the data point: {data_point}. Every {self.entity_name} should at least have {mandatory_keys}"
+                    f"Cannot find {primary_key_name} in the data point: {data_point}. Every {entity_name} should at least have {[primary_key_name]}"
                 )
+            keys_set.update(data_point)
+        # append rather than replace: the row ids already sitting in the
+        # posting lists keep pointing at the right rows, so repeated loads
+        # stay cumulative like they always were
+        start_row_id = len(self._data)
+        self._data.extend(data_red)
+        self._build_indices(start_row_id)
+        # loading data invalidates anything resolved against the old indices
+        self._cached_matches.cache_clear()
         return
 
-    def get_data_from_primary_keys(self, search_keys):
-        if not isinstance(search_keys, list):
-            search_keys = [search_keys]
-        # matches = []
-        # for key in search_keys:
-
-        #     data_point = self._indices[self.primary_key].get(key, None)
-        #     print(key, data_point)
-
-        #     if data_point:
-        #         matches.append(data_point)
-        matches = (
-            # deepcopy(self._indices[self.primary_key][str(key)])
-            # self._indices[self.primary_key][str(key)]
-            ujson.loads(ujson.dumps(self._indices[self.primary_key][str(key)]))
-            for key in search_keys
-            if self._indices[self.primary_key].get(str(key), None)
-            # and self._indices[self.primary_key][str(key)][self.primary_key] == key
-            # check to see that data and index have not diverged, commenting because i am making the assumption that the data wouldn't be updated/changed untill futher changes are needed in the code
-        )
-        return matches
+    def get_data_from_primary_keys(self, search_keys, copy=True):
+        # copy=True hands out clones that are safe to mutate, copy=False hands
+        # out O(1) read-only views for callers that only iterate the matches
+        wrap = _clone_data_point if copy else MappingProxyType
+        pk_index = self._indices[self.primary_key]
+        if isinstance(search_keys, list):
+            return (
+                wrap(data_point)
+                for data_point in map(pk_index.get, map(_as_index_key, search_keys))
+                if data_point
+                # not verifying that data and index have not diverged, making the assumption that the data wouldn't be updated/changed untill futher changes are needed in the code
+            )
+        # single key lookups are the overwhelmingly common case: answer them
+        # with one probe and a tuple, no list promotion or generator frame
+        data_point = pk_index.get(_as_index_key(search_keys), None)
+        return (wrap(data_point),) if data_point else ()
 
     def get_searchable_fields(self):
-        return list(self._indices.keys())
+        if self._lazy_indices:
+            # most indices may not exist yet; the key set knows every field
+            return self._keys_set | {self.primary_key}
+        # hand back the keys view itself: no list copy per call, and callers
+        # doing membership checks get the O(1) dict probe
+        return self._indices.keys()
 
     # def get_all_indices(self):
     #     return ujson.loads(ujson.dumps(self._indices))